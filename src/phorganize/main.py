@@ -2,15 +2,22 @@
 
 import argparse
 import asyncio
+import contextlib
 from datetime import datetime, timezone, timedelta
 import glob
+import heapq
+import itertools
+import json
 import magic
 import os
 import platform
+import re
 import shutil
 import subprocess
 import sys
-from typing import Optional
+import tempfile
+from typing import Iterable, Iterator, Optional
+import zlib
 
 
 class MediaFile:
@@ -37,10 +44,46 @@ class MediaFile:
         "application/octet-stream",
     ]
 
-    def __init__(self, file_path: str, tz: timezone):
+    # file extensions accepted when the date time is taken from the file name
+    TARGETED_EXTENSIONS = [
+        ".jpg",
+        ".jpeg",
+        ".heic",
+        ".png",
+        ".tif",
+        ".tiff",
+        ".dng",
+        ".crw",
+        ".cr2",
+        ".cr3",
+        ".raf",
+        ".x3f",
+        ".orf",
+        ".mp4",
+        ".mov",
+    ]
+
+    # file name patterns (matched against the name without extension) embedding the date time
+    # if the named group 'z' matches, the date time is in UTC, otherwise in the local time
+    FILENAME_PATTERNS = [
+        # renamed by phorganize, e.g. '20160507120409', '20250206181616-1'
+        r"(?P<Y>\d{4})(?P<m>\d{2})(?P<d>\d{2})(?P<H>\d{2})(?P<M>\d{2})(?P<S>\d{2})(-\d+)?",
+        # Android, e.g. 'IMG_20230101_120000', 'VID_20230101_120000'
+        r"(IMG|VID)_(?P<Y>\d{4})(?P<m>\d{2})(?P<d>\d{2})_(?P<H>\d{2})(?P<M>\d{2})(?P<S>\d{2})\d{0,3}(\D.*)?",
+        # Pixel (in UTC), e.g. 'PXL_20230101_120000123', 'PXL_20230101_120000123.MP'
+        r"(?P<z>PXL)_(?P<Y>\d{4})(?P<m>\d{2})(?P<d>\d{2})_(?P<H>\d{2})(?P<M>\d{2})(?P<S>\d{2})\d{0,3}(\D.*)?",
+    ]
+
+    def __init__(
+        self,
+        file_path: str,
+        tz: timezone,
+        name_patterns: Optional[list] = None,
+        verify: bool = False,
+    ):
         self.orig = file_path
         self.tz = tz
-        self.mime = magic.from_file(file_path, mime=True)
+        self.mime = ""
         self.valid = False
         self.dt: Optional[datetime] = None
         self.camera: str = ""  # Annotate as Optional[str]
@@ -48,7 +91,76 @@ class MediaFile:
         self.newname: str = ""
         self.ext: str = ""
         self.seq: int = 0  # sequence number for duplicate files
+        if name_patterns and self._extract_from_name(name_patterns):
+            if verify:
+                self._verify_name()
+        else:
+            self.mime = magic.from_file(file_path, mime=True)
+            self._extract_metadata()
+
+    def _extract_from_name(self, name_patterns: list) -> bool:
+        """
+        extract the date time from the file name without any file I/O.
+        the date time in the file name is regarded as the local time of the timezone,
+        or as UTC if the named group 'z' matched.
+
+        Args:
+            name_patterns: the list of compiled patterns with named groups Y, m, d (and H, M, S, z)
+
+        Returns:
+            bool: True if the file name matched one of the patterns
+        """
+        stem, ext = os.path.splitext(os.path.basename(self.orig))
+        if ext.lower() not in self.TARGETED_EXTENSIONS:
+            return False
+        for pattern in name_patterns:
+            m = pattern.fullmatch(stem)
+            if not m:
+                continue
+            fields = m.groupdict()
+            try:
+                Y, m, d, H, M, S = (
+                    int(fields.get(key) or 0) for key in ("Y", "m", "d", "H", "M", "S")
+                )
+                tz = timezone.utc if fields.get("z") else self.tz
+                self.dt = datetime(Y, m, d, H, M, S, tzinfo=tz).astimezone(self.tz)
+            except ValueError:
+                continue
+            self.valid = True
+            return True
+        return False
+
+    def _verify_name(self) -> None:
+        """
+        cross-check the date time taken from the file name with the metadata.
+        if the mime type is not targeted, the file is invalid and a warning is printed.
+        if they differ, the metadata wins and a warning is printed.
+        if the metadata can't be read, the date time from the file name is kept.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        name_dt = self.dt
+        self.mime = magic.from_file(self.orig, mime=True)
+        if self.mime not in self.TARGETED_MIME_TYPES:
+            print(
+                f"{self.orig}: the file name has a date time, but its mime type {self.mime} is not targeted",
+                file=sys.stderr,
+            )
+            self.valid = False
+            return
         self._extract_metadata()
+        if not self.valid:
+            self.dt = name_dt
+            self.valid = True
+        elif self.dt != name_dt:
+            print(
+                f"{self.orig}: date time in the file name ({name_dt}) differs from the metadata ({self.dt})",
+                file=sys.stderr,
+            )
 
     def _extract_metadata(self) -> None:
         """
@@ -141,13 +253,122 @@ class MediaFile:
             filename = f"{self.newname}{self.ext}"
         return os.path.join(self.target_dir, filename)
 
+    def to_record(self, input_base: str, output_base: str) -> dict:
+        """
+        return a plan record of the MediaFile object, which can be written to a plan file.
+        paths are stored relative to the input and output directories,
+        so the record can be used on hosts mounting them at different paths.
+
+        Args:
+            input_base: the input directory
+            output_base: the output directory
+
+        Returns:
+            dict: the plan record
+        """
+        return {
+            "orig": os.path.relpath(self.orig, input_base),
+            "tz": self.tz.utcoffset(None).total_seconds(),
+            "dt": self.dt.isoformat() if self.dt is not None else None,
+            "camera": self.camera,
+            "target_dir": os.path.relpath(self.target_dir, output_base),
+            "newname": self.newname,
+            "ext": self.ext,
+            "seq": self.seq,
+        }
+
+    @classmethod
+    def from_record(
+        cls, record: dict, input_base: str, output_base: str
+    ) -> "MediaFile":
+        """
+        restore a MediaFile object from a plan record without touching the file.
+
+        Args:
+            record: the plan record generated by to_record
+            input_base: the input directory
+            output_base: the output directory
+
+        Returns:
+            MediaFile: the restored MediaFile object
+        """
+        mf = cls.__new__(cls)
+        mf.orig = os.path.normpath(os.path.join(input_base, record["orig"]))
+        mf.tz = timezone(timedelta(seconds=record["tz"]))
+        mf.dt = datetime.fromisoformat(record["dt"]) if record["dt"] else None
+        mf.mime = ""
+        mf.valid = True
+        mf.camera = record["camera"]
+        mf.target_dir = os.path.normpath(
+            os.path.join(output_base, record["target_dir"])
+        )
+        mf.newname = record["newname"]
+        mf.ext = record["ext"]
+        mf.seq = record["seq"]
+        return mf
+
+
+def parse_name_pattern(pattern: str) -> re.Pattern:
+    """
+    compile a file name pattern given by --filename-pattern.
+
+    Args:
+        pattern: the regular expression with named groups Y, m, d (and optionally H, M, S, and z for UTC)
+
+    Returns:
+        re.Pattern: the compiled pattern
+    """
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        raise argparse.ArgumentTypeError(f"invalid pattern '{pattern}': {e}")
+    if not {"Y", "m", "d"} <= set(compiled.groupindex):
+        raise argparse.ArgumentTypeError(
+            f"invalid pattern '{pattern}', named groups 'Y', 'm' and 'd' are required"
+        )
+    return compiled
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """
+    parse a shard specification like '0/4' into a tuple of (index, count).
+
+    Args:
+        spec: the shard specification 'i/N' (0 <= i < N)
+
+    Returns:
+        tuple: the index of the shard and the number of shards
+    """
+    try:
+        index_str, count_str = spec.split("/")
+        index, count = int(index_str), int(count_str)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard '{spec}', expected 'i/N'")
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"invalid shard '{spec}', expected 0 <= i < N")
+    return (index, count)
+
 
 class FileOrganizer:
     """
     FileOrganizer class organizes photos and videos using embedded meta data in the files.
     It checks arguments, finds target files, builds MediaFile objects, assigns sequence numbers,
+    and moves or copies the files.
+    Work can be sharded: each shard writes a partial plan, a merge step assigns sequence
+    numbers globally and splits the plan into transfer partitions.
     """
 
+    # file names of partial plans (written by shards) and transfer partitions (written by merge)
+    PLAN_FILE = "plan-{index}-of-{count}.jsonl"
+    TRANSFER_FILE = "transfer-{index}-of-{count}.jsonl"
+    PLAN_FILE_PATTERN = re.compile(r"plan-(\d+)-of-(\d+)\.jsonl")
+    # number of runs merged at a time, to stay within the limit of open files
+    MERGE_FAN_IN = 64
+    # number of files held in memory at a time with --external-plan, unless --run-size is given
+    DEFAULT_RUN_SIZE = 100000
+    # options the plans are built with, which every phase must share
+    PLAN_OPTIONS = ["move", "rename", "camera", "lower", "upper", "tzdelta"]
+
     def __init__(self, args: argparse.Namespace) -> None:
         """
         initialize the FileOrganizer object with the command line arguments.
@@ -161,15 +382,17 @@ class FileOrganizer:
         self.args = args
         self._set_timezone()
         self.input_realpath = os.path.realpath(args.input)
+        self.input_base = (
+            os.path.dirname(self.input_realpath)
+            if os.path.isfile(self.input_realpath)
+            else self.input_realpath
+        )
         if args.output:
             self.output_base = os.path.realpath(args.output)
         else:
-            self.output_base = (
-                os.path.dirname(self.input_realpath)
-                if os.path.isfile(self.input_realpath)
-                else self.input_realpath
-            )
+            self.output_base = self.input_base
         self.media_files: list = []
+        self.name_patterns = self._get_name_patterns()
 
     def _set_timezone(self) -> None:
         """
@@ -196,6 +419,35 @@ class FileOrganizer:
                 # Fallback to UTC if tzinfo isn’t an instance of timezone.
                 self.tz = timezone.utc
 
+    def _get_name_patterns(self) -> Optional[list]:
+        """
+        return the file name patterns to take the date time from, if enabled.
+
+        Args:
+            None
+
+        Returns:
+            list: the compiled patterns, or None if disabled
+        """
+        if not self.args.filename_time:
+            return None
+        patterns = self.args.filename_pattern or []
+        return patterns + [re.compile(p) for p in MediaFile.FILENAME_PATTERNS]
+
+    def _in_verify_sample(self, file_path: str) -> bool:
+        """
+        check whether the file is in the sample specified by --filename-verify.
+        the sample is decided by the hash of the path, so it is reproducible.
+
+        Args:
+            file_path: the file path
+
+        Returns:
+            bool: True if the file should be cross-checked with the metadata
+        """
+        rate = self.args.filename_verify or 0.0
+        return zlib.crc32(file_path.encode()) % 10000 < rate * 10000
+
     def check_paths(self) -> None:
         """
         check the existence of the input path and the output directory.
@@ -235,19 +487,49 @@ class FileOrganizer:
         Returns:
             list: the list of files in the directory
         """
+        return sorted(self.iter_files())
+
+    def iter_files(self) -> Iterator[str]:
+        """
+        same as find_files, but yield the files one by one in no particular order
+        without holding the whole list in memory.
+
+        Args:
+            None
+
+        Returns:
+            Iterator: the files in the directory
+        """
         if os.path.isdir(self.input_realpath):
             pattern = (
                 os.path.join(self.input_realpath, "**", "*")
                 if self.args.recursive
                 else os.path.join(self.input_realpath, "*")
             )
-            return [
-                f
-                for f in sorted(glob.glob(pattern, recursive=self.args.recursive))
-                if os.path.isfile(f)
-            ]
-        else:
-            return [self.input_realpath]
+            for f in glob.iglob(pattern, recursive=self.args.recursive):
+                if self._in_shard(f) and os.path.isfile(f):
+                    yield f
+        elif self._in_shard(self.input_realpath):
+            yield self.input_realpath
+
+    def _in_shard(self, file_path: str) -> bool:
+        """
+        check whether the file belongs to the shard specified by --shard.
+        the partition is decided by the hash of the path relative to the input directory,
+        so it is identical on every worker and host, even if the input is mounted
+        at different paths.
+
+        Args:
+            file_path: the file path
+
+        Returns:
+            bool: True if the file belongs to the shard (or sharding is disabled)
+        """
+        if not self.args.shard:
+            return True
+        index, count = self.args.shard
+        rel_path = os.path.relpath(file_path, self.input_base)
+        return zlib.crc32(rel_path.encode()) % count == index
 
     async def build_media_files(self) -> None:
         """
@@ -269,6 +551,46 @@ class FileOrganizer:
                 mf.generate_target(base_dir=self.output_base, args=self.args)
                 self.media_files.append(mf)
 
+    def _run_size(self) -> int:
+        """
+        return the number of files held in memory at a time with --external-plan.
+
+        Args:
+            None
+
+        Returns:
+            int: the run size
+        """
+        return self.args.run_size or self.DEFAULT_RUN_SIZE
+
+    async def build_plan_runs(self, spill_dir: str) -> list:
+        """
+        generate MediaFile objects in batches of --run-size files,
+        and spill the plan records of each batch to a sorted run in the spill directory.
+        only one batch is held in memory at a time.
+
+        Args:
+            spill_dir: the directory to write the runs to
+
+        Returns:
+            list: the paths of the runs
+        """
+        run_paths: list[str] = []
+        files = self.iter_files()
+        while batch := list(itertools.islice(files, self._run_size())):
+            tasks = [
+                asyncio.to_thread(self._create_media_file, file_path=f) for f in batch
+            ]
+            records = []
+            for mf in await asyncio.gather(*tasks):
+                if mf and mf.valid:
+                    mf.generate_target(base_dir=self.output_base, args=self.args)
+                    records.append(self._to_record(mf))
+            run_path = os.path.join(spill_dir, f"run-{len(run_paths)}.jsonl")
+            self._write_records(run_path, sorted(records, key=self._plan_order))
+            run_paths.append(run_path)
+        return run_paths
+
     def _create_media_file(self, file_path: str = "") -> MediaFile:
         """
         create a MediaFile object from the file path.
@@ -279,7 +601,12 @@ class FileOrganizer:
         Returns:
             MediaFile: the MediaFile object
         """
-        mf = MediaFile(file_path=file_path, tz=self.tz)
+        mf = MediaFile(
+            file_path=file_path,
+            tz=self.tz,
+            name_patterns=self.name_patterns,
+            verify=self._in_verify_sample(file_path),
+        )
         return mf
 
     def assign_duplicate_sequence(self) -> None:
@@ -309,6 +636,372 @@ class FileOrganizer:
             else:
                 group[0].seq = 0
 
+    def _to_record(self, mf: MediaFile) -> dict:
+        """
+        return the plan record of the MediaFile object relative to the input and output directories.
+
+        Args:
+            mf: the MediaFile object
+
+        Returns:
+            dict: the plan record
+        """
+        return mf.to_record(input_base=self.input_base, output_base=self.output_base)
+
+    def _from_record(self, record: dict) -> MediaFile:
+        """
+        restore a MediaFile object from a plan record,
+        resolving its paths with the input and output directories of this host.
+
+        Args:
+            record: the plan record
+
+        Returns:
+            MediaFile: the restored MediaFile object
+        """
+        return MediaFile.from_record(
+            record, input_base=self.input_base, output_base=self.output_base
+        )
+
+    @staticmethod
+    def _plan_order(record: dict) -> tuple:
+        """
+        return the sort key of a plan record: files with the same newname are adjacent,
+        in the order of their original path as assign_duplicate_sequence sees them.
+
+        Args:
+            record: the plan record
+
+        Returns:
+            tuple: the sort key
+        """
+        return (record["newname"], record["orig"])
+
+    def _merge_runs(self, run_paths: list, spill_dir: str) -> Iterator[dict]:
+        """
+        merge sorted runs (or sorted plans) into a single stream of plan records.
+        at most MERGE_FAN_IN runs are opened at a time: while there are more,
+        groups of them are merged into new runs in the spill directory.
+
+        Args:
+            run_paths: the paths of the runs sorted by _plan_order
+            spill_dir: the directory to write the intermediate runs to
+
+        Returns:
+            Iterator: the plan records sorted by _plan_order
+        """
+        merge_pass = 0
+        while len(run_paths) > self.MERGE_FAN_IN:
+            merged_paths: list[str] = []
+            for start in range(0, len(run_paths), self.MERGE_FAN_IN):
+                merged_path = os.path.join(
+                    spill_dir, f"merge-{merge_pass}-{len(merged_paths)}.jsonl"
+                )
+                group = run_paths[start : start + self.MERGE_FAN_IN]
+                self._write_records(
+                    merged_path,
+                    heapq.merge(
+                        *(self._read_records(path) for path in group),
+                        key=self._plan_order,
+                    ),
+                )
+                if merge_pass > 0:
+                    # intermediate runs are no longer needed (the first pass may read plans)
+                    for path in group:
+                        os.remove(path)
+                merged_paths.append(merged_path)
+            run_paths = merged_paths
+            merge_pass += 1
+        return heapq.merge(
+            *(self._read_records(path) for path in run_paths), key=self._plan_order
+        )
+
+    @staticmethod
+    def _sequence_records(records: Iterable[dict]) -> Iterator[dict]:
+        """
+        assign sequence numbers to a stream of plan records sorted by _plan_order,
+        as assign_duplicate_sequence does, holding only a group's first two records.
+
+        Args:
+            records: the plan records sorted by _plan_order
+
+        Returns:
+            Iterator: the plan records with sequence numbers
+        """
+        for _, group in itertools.groupby(records, key=lambda r: r["newname"]):
+            first = next(group)
+            second = next(group, None)
+            if second is None:
+                first["seq"] = 0
+                yield first
+                continue
+            for index, record in enumerate(itertools.chain([first, second], group)):
+                record["seq"] = index + 1
+                yield record
+
+    @staticmethod
+    def _write_records(path: str, records: Iterable[dict]) -> None:
+        """
+        write plan records to a file as JSON lines.
+        the file is written to a temporary path and renamed, so readers never see a partial file.
+
+        Args:
+            path: the path of the file
+            records: the plan records
+
+        Returns:
+            None
+        """
+        FileOrganizer._write_partitions([path], records)
+
+    @staticmethod
+    def _write_partitions(paths: list, records: Iterable[dict]) -> None:
+        """
+        distribute plan records to files in round robin, as _write_records does for one file.
+        if writing fails, the temporary files are removed.
+
+        Args:
+            paths: the paths of the files
+            records: the plan records
+
+        Returns:
+            None
+        """
+        tmp_paths = [f"{path}.tmp" for path in paths]
+        try:
+            with contextlib.ExitStack() as stack:
+                files = [
+                    stack.enter_context(open(tmp_path, "w", encoding="utf-8"))
+                    for tmp_path in tmp_paths
+                ]
+                for f, record in zip(itertools.cycle(files), records):
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except BaseException:
+            for tmp_path in tmp_paths:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(tmp_path)
+            raise
+        for tmp_path, path in zip(tmp_paths, paths):
+            os.replace(tmp_path, path)
+
+    @staticmethod
+    def _read_records(path: str) -> Iterator[dict]:
+        """
+        read plan records from a file written by _write_records.
+
+        Args:
+            path: the path of the file
+
+        Returns:
+            Iterator: the plan records
+        """
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def write_plan(self) -> str:
+        """
+        write the partial plan of this shard to the plan directory.
+        the records are sorted by _plan_order, so plans can be merged as sorted runs.
+
+        Args:
+            None
+
+        Returns:
+            str: the path of the plan file
+        """
+        plan_path = self._plan_path()
+        self._write_plan_options(plan_path)
+        self._write_records(
+            plan_path,
+            sorted(
+                (self._to_record(mf) for mf in self.media_files), key=self._plan_order
+            ),
+        )
+        return plan_path
+
+    def _plan_path(self) -> str:
+        """
+        return the path of the partial plan of this shard, creating the plan directory.
+
+        Args:
+            None
+
+        Returns:
+            str: the path of the plan file
+        """
+        index, count = self.args.shard
+        os.makedirs(self.args.plan_dir, exist_ok=True)
+        return os.path.join(
+            self.args.plan_dir, self.PLAN_FILE.format(index=index, count=count)
+        )
+
+    def _write_plan_options(self, path: str) -> None:
+        """
+        write the options the plan (or transfer) file is built with next to it.
+
+        Args:
+            path: the path of the plan file
+
+        Returns:
+            None
+        """
+        options = {key: getattr(self.args, key) for key in self.PLAN_OPTIONS}
+        tmp_path = f"{path}.options.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(options, f)
+        os.replace(tmp_path, f"{path}.options.json")
+
+    def _check_plan_options(self, path: str) -> None:
+        """
+        check that the plan (or transfer) file was built with the same options as this run.
+
+        Args:
+            path: the path of the plan file
+
+        Returns:
+            None
+        """
+        try:
+            with open(f"{path}.options.json", encoding="utf-8") as f:
+                options = json.load(f)
+        except FileNotFoundError:
+            sys.exit(f"{path}.options.json: No such file or directory")
+        mismatched = [
+            key
+            for key in self.PLAN_OPTIONS
+            if options.get(key) != getattr(self.args, key)
+        ]
+        if mismatched:
+            sys.exit(
+                f"{path}: Built with different options: "
+                + ", ".join(f"{key}={options.get(key)}" for key in mismatched)
+            )
+
+    def _transfer_paths(self, count: int) -> list:
+        """
+        return the paths of the transfer partitions.
+
+        Args:
+            count: the number of the transfer partitions
+
+        Returns:
+            list: the paths of the transfer files
+        """
+        return [
+            os.path.join(
+                self.args.plan_dir, self.TRANSFER_FILE.format(index=index, count=count)
+            )
+            for index in range(count)
+        ]
+
+    def _find_plans(self) -> list:
+        """
+        find the partial plans in the plan directory and check that every shard finished.
+
+        Args:
+            None
+
+        Returns:
+            list: the paths of the plan files ordered by shard index
+        """
+        if not os.path.isdir(self.args.plan_dir):
+            sys.exit(f"{self.args.plan_dir}: No such file or directory")
+        plans: dict = {}
+        for name in os.listdir(self.args.plan_dir):
+            m = self.PLAN_FILE_PATTERN.fullmatch(name)
+            if m:
+                plans[(int(m.group(1)), int(m.group(2)))] = os.path.join(
+                    self.args.plan_dir, name
+                )
+        counts = {count for (_, count) in plans}
+        if len(counts) != 1:
+            sys.exit(f"{self.args.plan_dir}: Could not find plans of a single sharding")
+        count = counts.pop()
+        missing = [i for i in range(count) if (i, count) not in plans]
+        if missing:
+            sys.exit(
+                f"{self.args.plan_dir}: Missing plans of shard(s) "
+                + ", ".join(f"{i}/{count}" for i in missing)
+            )
+        return [plans[(i, count)] for i in range(count)]
+
+    def merge_plans(self) -> list:
+        """
+        merge the partial plans of all shards, assign sequence numbers globally
+        and write transfer partitions, one per shard.
+        files are ordered by their original path, so the result is identical to
+        the one of an unsharded run.
+        with --external-plan, the sorted plans are merged and sequenced in a streaming pass.
+
+        Args:
+            None
+
+        Returns:
+            list: the paths of the transfer files
+        """
+        plan_paths = self._find_plans()
+        for plan_path in plan_paths:
+            self._check_plan_options(plan_path)
+        transfer_paths = self._transfer_paths(len(plan_paths))
+        for transfer_path in transfer_paths:
+            self._write_plan_options(transfer_path)
+        if self.args.external_plan:
+            with tempfile.TemporaryDirectory(dir=self.args.spill_dir) as spill_dir:
+                self._write_partitions(
+                    transfer_paths,
+                    self._sequence_records(self._merge_runs(plan_paths, spill_dir)),
+                )
+            return transfer_paths
+
+        self.media_files = sorted(
+            (
+                self._from_record(record)
+                for path in plan_paths
+                for record in self._read_records(path)
+            ),
+            key=lambda mf: mf.orig,
+        )
+        self.assign_duplicate_sequence()
+        self._write_partitions(
+            transfer_paths, (self._to_record(mf) for mf in self.media_files)
+        )
+        return transfer_paths
+
+    def _transfer_path(self) -> str:
+        """
+        return the path of the transfer partition specified by --transfer.
+
+        Args:
+            None
+
+        Returns:
+            str: the path of the transfer file
+        """
+        index, count = self.args.transfer
+        transfer_path = os.path.join(
+            self.args.plan_dir, self.TRANSFER_FILE.format(index=index, count=count)
+        )
+        if not os.path.exists(transfer_path):
+            sys.exit(f"{transfer_path}: No such file or directory")
+        self._check_plan_options(transfer_path)
+        return transfer_path
+
+    def load_transfer(self) -> None:
+        """
+        load MediaFile objects from the transfer partition specified by --transfer.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.media_files = [
+            self._from_record(record)
+            for record in self._read_records(self._transfer_path())
+        ]
+
     async def process_media_file(self, mf: MediaFile) -> None:
         """
         create a directory for the MediaFile object and move or copy the file to the directory.
@@ -345,19 +1038,94 @@ class FileOrganizer:
         2. assign sequence numbers
         3. execute moving/copying each file asynchronously
 
+        with --shard, only 1. is executed and the partial plan is written.
+        with --merge, the partial plans are merged to execute 2.
+        with --transfer, 3. is executed for a transfer partition.
+        --merge and --transfer stop if the plans were built with different options.
+        with --external-plan, plan records are spilled to disk instead of held in memory,
+        and transfer partitions are read in batches.
+
         Args:
             None
 
         Returns:
             None
         """
-        print(f"Processing files in {self.input_realpath}...")
-        await self.build_media_files()
-        self.assign_duplicate_sequence()
+        if self.args.merge:
+            print(f"Merging plans in {self.args.plan_dir}...")
+            self.merge_plans()
+        elif self.args.transfer:
+            print(
+                f"Processing transfer {self.args.transfer[0]}/{self.args.transfer[1]}..."
+            )
+            if self.args.external_plan:
+                await self.transfer_records(self._read_records(self._transfer_path()))
+            else:
+                self.load_transfer()
+                await self.transfer_media_files()
+        else:
+            print(f"Processing files in {self.input_realpath}...")
+            if self.args.external_plan:
+                await self.execute_external()
+            elif self.args.shard:
+                await self.build_media_files()
+                self.write_plan()
+            else:
+                await self.build_media_files()
+                self.assign_duplicate_sequence()
+                await self.transfer_media_files()
+        print("Done.")
+
+    async def execute_external(self) -> None:
+        """
+        execute the file processing with bounded memory.
+        plan records are spilled to sorted runs, merged and sequenced in a streaming pass,
+        then moved/copied in batches of --run-size files.
+        with --shard, the merged records are written to the partial plan instead.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with tempfile.TemporaryDirectory(dir=self.args.spill_dir) as spill_dir:
+            records = self._merge_runs(await self.build_plan_runs(spill_dir), spill_dir)
+            if self.args.shard:
+                plan_path = self._plan_path()
+                self._write_plan_options(plan_path)
+                self._write_records(plan_path, records)
+                return
+            await self.transfer_records(self._sequence_records(records))
+
+    async def transfer_records(self, records: Iterable[dict]) -> None:
+        """
+        move or copy the files of a stream of plan records in batches of --run-size files,
+        holding only one batch in memory at a time.
 
+        Args:
+            records: the plan records with sequence numbers
+
+        Returns:
+            None
+        """
+        records = iter(records)
+        while batch := list(itertools.islice(records, self._run_size())):
+            self.media_files = [self._from_record(r) for r in batch]
+            await self.transfer_media_files()
+
+    async def transfer_media_files(self) -> None:
+        """
+        move or copy all MediaFile objects asynchronously.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
         tasks = [self.process_media_file(mf) for mf in self.media_files]
         await asyncio.gather(*tasks)
-        print("Done.")
 
 
 def parse_args() -> argparse.Namespace:
@@ -425,12 +1193,81 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--tzdelta", help="Timezone delta where photos/videos taken in. e.g. '+9'"
     )
+    parser.add_argument(
+        "--filename-time",
+        help="Take date time from file names like '20160507120409.CR2' without reading metadata (not with --camera)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--filename-pattern",
+        help="Regular expression of file names with named groups Y, m, d, H, M, S (z for UTC), tried before the built-in ones (with --filename-time)",
+        type=parse_name_pattern,
+        action="append",
+    )
+    parser.add_argument(
+        "--filename-verify",
+        help="Ratio of files whose date time from the file name is cross-checked with metadata (with --filename-time). e.g. '0.01'",
+        type=float,
+    )
+    parser.add_argument(
+        "--external-plan",
+        help="Spill plans to sorted runs on disk to process huge trees with bounded memory",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--run-size",
+        help="Number of files held in memory at a time with --external-plan (default 100000)",
+        type=int,
+    )
+    parser.add_argument(
+        "--spill-dir", help="Directory to save the runs of --external-plan"
+    )
+    phase = parser.add_mutually_exclusive_group()
+    phase.add_argument(
+        "--shard",
+        help="Only extract metadata of shard 'i/N' and write a partial plan to --plan-dir",
+        type=parse_shard,
+    )
+    phase.add_argument(
+        "--merge",
+        help="Merge the partial plans in --plan-dir and write transfer partitions",
+        action="store_true",
+    )
+    phase.add_argument(
+        "--transfer",
+        help="Move/copy files of transfer partition 'i/N' in --plan-dir",
+        type=parse_shard,
+    )
+    parser.add_argument(
+        "--plan-dir", help="Directory shared by workers to save plans and transfers"
+    )
     args = parser.parse_args()
 
+    if (args.run_size is not None or args.spill_dir) and not args.external_plan:
+        parser.error("'--run-size' and '--spill-dir' require '--external-plan'.")
+    if args.run_size is not None and args.run_size < 1:
+        parser.error("'--run-size' must be a positive number.")
+    if (args.shard or args.merge or args.transfer) and not args.plan_dir:
+        parser.error("'--plan-dir' is required with 'shard', 'merge', or 'transfer'.")
+    if args.plan_dir and not (args.shard or args.merge or args.transfer):
+        parser.error("'--plan-dir' requires one of 'shard', 'merge', or 'transfer'.")
+
     if not (args.move or args.rename or args.camera):
         parser.error(
             "Nothing to do. Please specify one of arguments, 'move', 'rename', or 'camera'."
         )
+    if args.filename_time and args.camera:
+        parser.error(
+            "'--filename-time' can't be used with 'camera', the camera model is only in the metadata."
+        )
+    if (
+        args.filename_pattern or args.filename_verify is not None
+    ) and not args.filename_time:
+        parser.error(
+            "'--filename-pattern' and '--filename-verify' require '--filename-time'."
+        )
+    if args.filename_verify is not None and not 0 <= args.filename_verify <= 1:
+        parser.error("'--filename-verify' must be between 0 and 1.")
     return args
 
 
@@ -1,14 +1,25 @@
 #!/usr/bin/env python3
 import argparse
+import asyncio
+import multiprocessing
 import os
+import re
 import sys
+import tempfile
 import unittest
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timezone, timedelta
 from io import StringIO
 from unittest.mock import patch
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "src"))
-from phorganize.main import MediaFile, FileOrganizer
+from phorganize.main import (
+    MediaFile,
+    FileOrganizer,
+    parse_args,
+    parse_name_pattern,
+    parse_shard,
+)
 
 
 #######################################################################
@@ -125,6 +136,16 @@ class TestFileOrganizerSync(unittest.TestCase):
             tzdelta=None,
             input="dummy_input",
             verbose=False,
+            filename_time=False,
+            filename_pattern=None,
+            filename_verify=None,
+            external_plan=False,
+            run_size=None,
+            spill_dir=None,
+            shard=None,
+            merge=False,
+            transfer=None,
+            plan_dir=None,
         )
         self.organizer = FileOrganizer(self.args)
         self.organizer.tz = timezone(timedelta(hours=9))
@@ -174,6 +195,16 @@ class TestFileOrganizerAsync(unittest.IsolatedAsyncioTestCase):
             tzdelta=None,
             input="dummy_input",
             verbose=False,
+            filename_time=False,
+            filename_pattern=None,
+            filename_verify=None,
+            external_plan=False,
+            run_size=None,
+            spill_dir=None,
+            shard=None,
+            merge=False,
+            transfer=None,
+            plan_dir=None,
         )
         self.organizer = FileOrganizer(self.args)
         self.organizer.tz = timezone(timedelta(hours=9))
@@ -221,5 +252,349 @@ class TestFileOrganizerAsync(unittest.IsolatedAsyncioTestCase):
                 self.assertTrue(hasattr(mf, "ext"))
 
 
+#######################################################################
+# Tests for date time from file names
+#######################################################################
+class TestFilenameTime(unittest.TestCase):
+    def setUp(self):
+        self.tz = timezone(timedelta(hours=9))
+        self.patterns = [re.compile(p) for p in MediaFile.FILENAME_PATTERNS]
+
+    @patch("magic.from_file")
+    @patch("subprocess.check_output")
+    def test_name_match_without_io(self, mock_check_output, mock_from_file):
+        for name, expected in (
+            ("20160507120409.CR2", datetime(2016, 5, 7, 12, 4, 9)),
+            ("20250206181616-2.CR3", datetime(2025, 2, 6, 18, 16, 16)),
+            ("IMG_20230101_120000.jpg", datetime(2023, 1, 1, 12, 0, 0)),
+            # Pixel names are in UTC.
+            ("PXL_20231201_101539123.MP.jpg", datetime(2023, 12, 1, 19, 15, 39)),
+            ("PXL_20231231_200000000.jpg", datetime(2024, 1, 1, 5, 0, 0)),
+        ):
+            mf = MediaFile(file_path=name, tz=self.tz, name_patterns=self.patterns)
+            self.assertTrue(mf.valid)
+            self.assertEqual(mf.dt, expected.replace(tzinfo=self.tz))
+        mock_from_file.assert_not_called()
+        mock_check_output.assert_not_called()
+
+    @patch("magic.from_file", return_value="image/jpeg")
+    @patch(
+        "subprocess.check_output", return_value=b"Canon\x002023-01-01 12:00:00 +0900"
+    )
+    def test_name_mismatch_falls_back(self, mock_check_output, mock_from_file):
+        # Not a date time, or not a targeted extension.
+        for name in ("IMG_9873.HEIC", "20231301120000.jpg", "20230101120000.txt"):
+            mf = MediaFile(file_path=name, tz=self.tz, name_patterns=self.patterns)
+            self.assertEqual(mf.camera, "Canon")
+        self.assertEqual(mock_check_output.call_count, 3)
+
+    @patch("magic.from_file", return_value="image/jpeg")
+    @patch(
+        "subprocess.check_output", return_value=b"Canon\x002023-01-01 12:00:05 +0900"
+    )
+    def test_verify_prefers_metadata(self, mock_check_output, mock_from_file):
+        with patch("sys.stderr", new=StringIO()) as stderr:
+            mf = MediaFile(
+                file_path="20230101120000.jpg",
+                tz=self.tz,
+                name_patterns=self.patterns,
+                verify=True,
+            )
+        self.assertEqual(mf.dt, datetime(2023, 1, 1, 12, 0, 5, tzinfo=self.tz))
+        self.assertIn("differs from the metadata", stderr.getvalue())
+
+    @patch("magic.from_file", return_value="text/html")
+    @patch("subprocess.check_output")
+    def test_verify_rejects_non_targeted_mime(self, mock_check_output, mock_from_file):
+        with patch("sys.stderr", new=StringIO()) as stderr:
+            mf = MediaFile(
+                file_path="20230101120000.jpg",
+                tz=self.tz,
+                name_patterns=self.patterns,
+                verify=True,
+            )
+        self.assertFalse(mf.valid)
+        self.assertIn("is not targeted", stderr.getvalue())
+        mock_check_output.assert_not_called()
+
+    def test_organizer_patterns(self):
+        args = argparse.Namespace(
+            camera=False,
+            tzdelta="+9",
+            input="dummy_input",
+            output="output_dir",
+            filename_time=True,
+            filename_pattern=[
+                parse_name_pattern(r"(?P<Y>\d{4})(?P<m>\d{2})(?P<d>\d{2})(?P<H>\d{2})")
+            ],
+            filename_verify=None,
+            shard=None,
+        )
+        organizer = FileOrganizer(args)
+        self.assertEqual(len(organizer.name_patterns), 4)
+        mf = organizer._create_media_file(file_path="2023120110.MP4")
+        self.assertEqual(mf.dt, datetime(2023, 12, 1, 10, tzinfo=organizer.tz))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_name_pattern(r"(?P<Y>\d{4})")
+
+    def test_parse_args_rejects_ignored_options(self):
+        for argv in (
+            # The camera model is only in the metadata.
+            ["-c", "--filename-time"],
+            ["-r", "--filename-pattern", r"(?P<Y>\d{4})(?P<m>\d{2})(?P<d>\d{2})"],
+            ["-r", "--filename-verify", "0.1"],
+            ["-r", "--filename-time", "--filename-verify", "1.5"],
+        ):
+            with (
+                patch("sys.argv", ["phorganize", *argv, "dummy_input"]),
+                patch("sys.stderr", new=StringIO()),
+                self.assertRaises(SystemExit),
+            ):
+                parse_args()
+        with patch(
+            "sys.argv",
+            ["phorganize", "-r", "--filename-time", "--filename-verify", "0.1", "x"],
+        ):
+            self.assertEqual(parse_args().filename_verify, 0.1)
+
+
+#######################################################################
+# Tests for sharded execution
+#######################################################################
+def fake_mdls(cmd):
+    # IMG_0000.JPG to IMG_0002.JPG share the same capture time, and so on,
+    # so they get sequence numbers.
+    index = int(os.path.basename(cmd[-1])[4:8])
+    return f"Canon\x002023-01-01 12:00:{index // 3:02d} +0900".encode()
+
+
+def run_phase(args):
+    # Executed in a worker process, like a phorganize command of a phase.
+    with (
+        patch("magic.from_file", return_value="image/jpeg"),
+        patch("subprocess.check_output", side_effect=fake_mdls),
+        patch("sys.stdout", new=StringIO()),
+    ):
+        asyncio.run(FileOrganizer(args).execute())
+
+
+class PlanTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.input_dir = os.path.join(self.tmp.name, "input")
+        self.output_dir = os.path.join(self.tmp.name, "output")
+        self.plan_dir = os.path.join(self.tmp.name, "plans")
+        os.makedirs(self.input_dir)
+        for i in range(12):
+            name = f"IMG_{i:04d}.JPG"
+            with open(os.path.join(self.input_dir, name), "w") as f:
+                f.write(name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_args(self, **kwargs):
+        args = argparse.Namespace(
+            move=False,
+            rename=True,
+            camera=False,
+            lower=False,
+            upper=False,
+            dryrun=True,
+            recursive=False,
+            output=self.output_dir,
+            tzdelta="+9",
+            input=self.input_dir,
+            verbose=False,
+            filename_time=False,
+            filename_pattern=None,
+            filename_verify=None,
+            external_plan=False,
+            run_size=None,
+            spill_dir=None,
+            shard=None,
+            merge=False,
+            transfer=None,
+            plan_dir=self.plan_dir,
+        )
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        return args
+
+    async def plan(self, args):
+        organizer = FileOrganizer(args)
+        with (
+            patch("magic.from_file", return_value="image/jpeg"),
+            patch("subprocess.check_output", side_effect=fake_mdls),
+        ):
+            await organizer.build_media_files()
+        return organizer
+
+    async def write_shard_plans(self, count):
+        for index in range(count):
+            organizer = await self.plan(self.make_args(shard=(index, count)))
+            organizer.write_plan()
+
+    async def expected_targets(self):
+        # The targets of an unsharded in-memory run.
+        organizer = await self.plan(self.make_args())
+        organizer.assign_duplicate_sequence()
+        return {mf.orig: mf.get_target_fullpath() for mf in organizer.media_files}
+
+    async def execute_targets(self, *args_list):
+        # Execute each command, collecting the targets instead of moving/copying.
+        targets = {}
+
+        async def collect(mf):
+            targets[mf.orig] = mf.get_target_fullpath()
+
+        for args in args_list:
+            organizer = FileOrganizer(args)
+            with (
+                patch("magic.from_file", return_value="image/jpeg"),
+                patch("subprocess.check_output", side_effect=fake_mdls),
+                patch.object(organizer, "process_media_file", new=collect),
+                patch("sys.stdout", new=StringIO()),
+            ):
+                await organizer.execute()
+        return targets
+
+
+class TestShardedExecution(PlanTestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("1/4"), (1, 4))
+        for spec in ("4/4", "-1/4", "0/0", "1", "a/b"):
+            with self.assertRaises(argparse.ArgumentTypeError):
+                parse_shard(spec)
+
+    async def test_shards_partition_files(self):
+        files = []
+        for index in range(3):
+            organizer = FileOrganizer(self.make_args(shard=(index, 3)))
+            files.extend(organizer.find_files())
+        self.assertEqual(sorted(files), FileOrganizer(self.make_args()).find_files())
+
+    async def test_merge_matches_unsharded_run(self):
+        count = 3
+        await self.write_shard_plans(count)
+
+        merger = FileOrganizer(self.make_args(merge=True))
+        transfer_paths = merger.merge_plans()
+        self.assertEqual(len(transfer_paths), count)
+
+        targets = await self.execute_targets(
+            *(self.make_args(transfer=(index, count)) for index in range(count))
+        )
+        self.assertEqual(targets, await self.expected_targets())
+
+    async def test_execute_phases_in_processes(self):
+        count = 3
+        with ProcessPoolExecutor(
+            max_workers=count, mp_context=multiprocessing.get_context("fork")
+        ) as pool:
+            list(
+                pool.map(
+                    run_phase,
+                    [self.make_args(shard=(i, count)) for i in range(count)],
+                )
+            )
+            pool.submit(run_phase, self.make_args(merge=True)).result()
+            list(
+                pool.map(
+                    run_phase,
+                    [
+                        self.make_args(transfer=(i, count), dryrun=False)
+                        for i in range(count)
+                    ],
+                )
+            )
+
+        for orig, target in (await self.expected_targets()).items():
+            with open(target) as f:
+                self.assertEqual(f.read(), os.path.basename(orig))
+        copied = [files for _, _, files in os.walk(self.output_dir)]
+        self.assertEqual(sum(len(files) for files in copied), 12)
+
+    async def test_phases_reject_different_options(self):
+        await self.write_shard_plans(2)
+        with (
+            patch("sys.stdout", new=StringIO()),
+            self.assertRaises(SystemExit),
+        ):
+            await FileOrganizer(self.make_args(merge=True, move=True)).execute()
+        FileOrganizer(self.make_args(merge=True)).merge_plans()
+        with (
+            patch("sys.stdout", new=StringIO()),
+            self.assertRaises(SystemExit),
+        ):
+            await FileOrganizer(
+                self.make_args(transfer=(0, 2), move=True, tzdelta="+0")
+            ).execute()
+
+    async def test_merge_missing_shard(self):
+        organizer = await self.plan(self.make_args(shard=(0, 2)))
+        organizer.write_plan()
+        with self.assertRaises(SystemExit):
+            FileOrganizer(self.make_args(merge=True)).merge_plans()
+
+
+#######################################################################
+# Tests for external-memory planning
+#######################################################################
+class TestExternalPlan(PlanTestCase):
+    async def test_external_plan_matches_in_memory(self):
+        # 12 files are spilled to 3 runs.
+        targets = await self.execute_targets(
+            self.make_args(external_plan=True, run_size=5)
+        )
+        self.assertEqual(targets, await self.expected_targets())
+
+    async def test_external_merge_and_transfer_match_in_memory(self):
+        count = 3
+        await self.write_shard_plans(count)
+        targets = await self.execute_targets(
+            self.make_args(merge=True, external_plan=True),
+            *(
+                self.make_args(transfer=(index, count), external_plan=True, run_size=2)
+                for index in range(count)
+            ),
+        )
+        self.assertEqual(targets, await self.expected_targets())
+
+    async def test_external_plan_merges_in_passes(self):
+        # 12 runs of a file are merged 2 at a time in 3 passes.
+        with patch.object(FileOrganizer, "MERGE_FAN_IN", 2):
+            targets = await self.execute_targets(
+                self.make_args(external_plan=True, run_size=1)
+            )
+        self.assertEqual(targets, await self.expected_targets())
+
+    def test_parse_args_rejects_ignored_options(self):
+        for argv in (
+            ["--run-size", "10"],
+            ["--spill-dir", "spill"],
+            ["--external-plan", "--run-size", "0"],
+            ["--plan-dir", "plans"],
+        ):
+            with (
+                patch("sys.argv", ["phorganize", "-r", *argv, "dummy_input"]),
+                patch("sys.stderr", new=StringIO()),
+                self.assertRaises(SystemExit),
+            ):
+                parse_args()
+
+    def test_write_partitions_removes_temporary_files(self):
+        def records():
+            yield {"orig": "IMG_0000.JPG"}
+            raise RuntimeError("merge failed")
+
+        paths = [
+            os.path.join(self.tmp.name, f"transfer-{i}-of-2.jsonl") for i in range(2)
+        ]
+        with self.assertRaises(RuntimeError):
+            FileOrganizer._write_partitions(paths, records())
+        self.assertEqual(os.listdir(self.tmp.name), ["input"])
+
+
 if __name__ == "__main__":
     unittest.main()